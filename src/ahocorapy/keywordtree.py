@@ -10,7 +10,10 @@ Created on Jan 5, 2016
 @author: Frederik Petersen (fp@abusix.com)
 '''
 
-from builtins import object
+from array import array
+from builtins import map, object, str
+from collections import deque
+from itertools import repeat
 
 
 """
@@ -29,6 +32,59 @@ _case_insensitive表示是否大小写敏感，True表示不敏感，False表示
 如果不能匹配上，则去父节点failure指向节点的failure状态指向的节点中去寻找是否能匹配上
 """
 
+# Upper bound for the number of columns (distinct keyword symbols + 1) of the
+# flat transition table. Every state gets a full row, so trees over a bigger
+# alphabet (e.g. CJK keywords) are searched by walking the state graph
+# instead of growing the table by width cells per state.
+_MAX_TABLE_WIDTH = 256
+
+
+def _index_typecode(size):
+    '''
+    Smallest signed array typecode able to hold the values
+    -(size - 1) .. size - 1.
+    '''
+    if size <= 1 << 7:
+        return 'b'
+    if size <= 1 << 15:
+        return 'h'
+    return 'i'
+
+
+def _search_table(goto, width, output, symbol_ids):
+    '''
+    Runs the automaton over a sequence of column ids.
+    goto is a single flat array holding one row of width cells per state.
+    The cells hold the row offset of the next state, negated if keywords
+    end in that state, so most symbols cost one index and one comparison.
+    Only touches ints and flat arrays, which keeps the loop cheap for the
+    interpreter and easy to compile for a tracing JIT like pypy's.
+    '''
+    state = 0
+    for idx, column in enumerate(symbol_ids):
+        state = goto[state + column]
+        if state < 0:
+            state = -state
+            for keyword in output[state // width]:
+                yield (keyword, idx + 1 - len(keyword))
+
+
+def _search_table_list(goto, width, output, symbol_ids):
+    '''
+    Same as _search_table(), but collects all results into a list instead
+    of suspending the generator for every match.
+    '''
+    results = []
+    append = results.append
+    state = 0
+    for idx, column in enumerate(symbol_ids):
+        state = goto[state + column]
+        if state < 0:
+            state = -state
+            for keyword in output[state // width]:
+                append((keyword, idx + 1 - len(keyword)))
+    return results
+
 
 class State(object):
     __slots__ = ['identifier', 'symbol', 'success', 'transitions', 'parent',
@@ -67,6 +123,12 @@ class KeywordTree(object):
         self._counter = 1
         self._finalized = False
         self._case_insensitive = case_insensitive
+        self._single_keyword = None
+        self._alphabet = None
+        self._ascii_columns = None
+        self._width = None
+        self._goto = None
+        self._output = None
 
     def add(self, keyword):
         '''
@@ -127,15 +189,91 @@ class KeywordTree(object):
         if not self._finalized:
             raise ValueError('KeywordTree has not been finalized.' +
                              ' No search allowed. Call finalize() first.')
+        if (self._single_keyword is not None and
+                isinstance(text, type(self._single_keyword))):
+            for result in self._search_single(text):
+                yield result
+            return
+        if self._goto is None:
+            if self._case_insensitive:
+                text = text.lower()
+            for result in self._search_all_states(text):
+                yield result
+            return
+        for result in _search_table(self._goto, self._width, self._output,
+                                    self._symbol_ids(text)):
+            yield result
+
+    def _search_single(self, text):
+        '''
+        Search for trees holding a single keyword. str.find() runs in C and
+        beats walking the automaton by far.
+        '''
+        keyword = self._single_keyword
+        pattern = keyword
         if self._case_insensitive:
             text = text.lower()
-        current_state = self._zero_state
+            pattern = keyword.lower()
+        idx = text.find(pattern)
+        while idx >= 0:
+            yield (keyword, idx)
+            idx = text.find(pattern, idx + 1)
+
+    def _symbol_ids(self, text):
+        '''
+        Translates text into the column ids of the goto table.
+        ASCII texts are translated with a single bytes.translate() call if
+        all keywords are ASCII as well. In case insensitive mode that table
+        also folds upper case letters, so only other texts need lower().
+        '''
+        if self._ascii_columns is not None and isinstance(text, str):
+            try:
+                return bytearray(
+                    text.encode('ascii').translate(self._ascii_columns))
+            except UnicodeError:
+                pass
+        if self._case_insensitive:
+            text = text.lower()
+        return map(self._alphabet.get, text, repeat(0))
+
+    def search_all_list(self, text):
+        '''
+        Search a text for all occurences of the added keywords.
+        Same as search_all(), but returns all results at once, which is
+        faster than iterating the generator for texts with many matches.
+        Can only be called after finalized() has been called.
+        O(n) with n = len(text)
+        @return: List of 2-Tuples with keyword and startindex in text.
+                 Empty if no keyword was found in the text.
+        '''
+        if not self._finalized:
+            raise ValueError('KeywordTree has not been finalized.' +
+                             ' No search allowed. Call finalize() first.')
+        if (self._single_keyword is not None and
+                isinstance(text, type(self._single_keyword))):
+            return list(self._search_single(text))
+        if self._goto is None:
+            if self._case_insensitive:
+                text = text.lower()
+            return list(self._search_all_states(text))
+        return _search_table_list(self._goto, self._width, self._output,
+                                  self._symbol_ids(text))
+
+    def _search_all_states(self, text):
+        '''
+        Fallback for search_all() on trees without a flat transition table.
+        '''
+        zero_state = self._zero_state
+        current_state = zero_state
         for idx, symbol in enumerate(text):
-            current_state = current_state.transitions.get(
-                symbol, self._zero_state.transitions.get(symbol,
-                                                         self._zero_state))
+            transitions = current_state.transitions
+            while (symbol not in transitions and
+                   current_state is not zero_state):
+                current_state = current_state.longest_strict_suffix
+                transitions = current_state.transitions
+            current_state = transitions.get(symbol, zero_state)
             state = current_state
-            while state != self._zero_state:
+            while state is not zero_state:
                 if state.success:
                     keyword = state.matched_keyword
                     yield (keyword, idx + 1 - len(keyword))
@@ -150,82 +288,221 @@ class KeywordTree(object):
             raise ValueError('KeywordTree has already been finalized.')
         self._zero_state.longest_strict_suffix = self._zero_state
         self.search_lss_for_children(self._zero_state)
+        self._build_tables()
         self._finalized = True
 
-    def search_lss_for_children(self, zero_state):
-        processed = set()
-        to_process = [zero_state]
+    def _build_tables(self):
+        '''
+        Flattens the state graph into arrays indexed by state identifier,
+        after renumbering the states breadth first. fail[state] is the
+        longest strict suffix and output[state] the tuple of all keywords
+        ending in that state.
+        goto is one contiguous array of rows of width cells, with columns
+        given by the alphabet map (column 0 is used for symbols not in any
+        keyword). goto[state * width + column] holds the row offset
+        (next_state * width) of the next state, negated if output[next_state]
+        is not empty. Missing transitions are filled in from the longest
+        strict suffix, so the table is a complete DFA.
+        '''
+        zero_state = self._zero_state
+        order = []
+        alphabet = {}
+        seen = bytearray(self._counter)
+        seen[0] = 1
+        to_process = deque([zero_state])
         while to_process:
-            state = to_process.pop()
-            processed.add(state.identifier)
-            for child in state.transitions.values():
-                if child.identifier not in processed:
-                    self.search_lss(child)
+            state = to_process.popleft()
+            order.append(state)
+            for symbol, child in state.transitions.items():
+                if symbol not in alphabet:
+                    alphabet[symbol] = len(alphabet) + 1
+                # Trees pickled by older versions also hold shortcut
+                # transitions, which never lead deeper than the state itself
+                # and thus only point to states that were already seen.
+                if not seen[child.identifier]:
+                    seen[child.identifier] = 1
                     to_process.append(child)
+        # Renumber the states in breadth first order. Shallow states, which
+        # most transitions lead to, then share the first rows of the table.
+        for identifier, state in enumerate(order):
+            state.identifier = identifier
+        keywords = [state.matched_keyword for state in order if state.success]
+        self._single_keyword = None
+        # Keywords given as token sequences have no find() to search with.
+        if len(keywords) == 1 and hasattr(keywords[0], 'find'):
+            self._single_keyword = keywords[0]
+        width = len(alphabet) + 1
+        # Row offsets have to fit into a signed 32 bit array cell.
+        if width > _MAX_TABLE_WIDTH or self._counter * width >= 1 << 31:
+            self._alphabet = self._ascii_columns = self._width = None
+            self._goto = self._output = None
+            return
+        fail = array(_index_typecode(self._counter), [0]) * self._counter
+        output = [None] * self._counter
+        output[0] = ()
+        # Breadth first order guarantees that the (shallower) longest strict
+        # suffixes are complete before they are used.
+        for state in order[1:]:
+            identifier = state.identifier
+            suffix = state.longest_strict_suffix.identifier
+            fail[identifier] = suffix
+            if state.success:
+                output[identifier] = (state.matched_keyword,) + output[suffix]
+            else:
+                # States without own keyword share their suffix's tuple, so
+                # all states without any output share the single empty one.
+                output[identifier] = output[suffix]
+        cells = self._counter * width
+        goto = array(_index_typecode(cells), [0]) * cells
+        for state in order:
+            offset = state.identifier * width
+            if state is not zero_state:
+                suffix = fail[state.identifier] * width
+                goto[offset:offset + width] = goto[suffix:suffix + width]
+            for symbol, child in state.transitions.items():
+                cell = child.identifier * width
+                goto[offset + alphabet[symbol]] =\
+                    -cell if output[child.identifier] else cell
+        self._alphabet = alphabet
+        self._ascii_columns = None
+        # Keywords given as bytes on python 3 have int symbols and keywords
+        # given as token sequences may have longer str symbols, which keep
+        # using the alphabet map.
+        if all(isinstance(symbol, str) and len(symbol) == 1 and
+               ord(symbol) < 128 for symbol in alphabet):
+            columns = bytearray(256)
+            for symbol, column in alphabet.items():
+                columns[ord(symbol)] = column
+                if self._case_insensitive:
+                    columns[ord(symbol.upper())] = column
+            self._ascii_columns = bytes(columns)
+        self._width = width
+        self._goto = goto
+        self._output = output
 
-    def search_lss(self, state):
-        if state.longest_strict_suffix is None:
-            parent = state.parent
-            traversed = parent.longest_strict_suffix
-            while True:
-                if state.symbol in traversed.transitions and\
-                        traversed.transitions[state.symbol] != state:
-                    state.longest_strict_suffix =\
-                        traversed.transitions[state.symbol]
-                    break
-                elif traversed == self._zero_state:
-                    state.longest_strict_suffix = self._zero_state
-                    break
-                else:
+    def search_lss_for_children(self, zero_state):
+        '''
+        Computes the longest strict suffix of every state breadth first, so
+        the suffix of a state's parent is always known before the state
+        itself is processed.
+        Parent links are only needed while building the tree and are cleared
+        on the way, so finalized trees hold no parent/child reference cycles.
+        '''
+        to_process = deque()
+        for child in zero_state.transitions.values():
+            child.longest_strict_suffix = zero_state
+            child.parent = None
+            to_process.append(child)
+        while to_process:
+            state = to_process.popleft()
+            for symbol, child in state.transitions.items():
+                traversed = state.longest_strict_suffix
+                while (symbol not in traversed.transitions and
+                       traversed is not zero_state):
                     traversed = traversed.longest_strict_suffix
-            suffix = state.longest_strict_suffix
-            if suffix.longest_strict_suffix is None:
-                self.search_lss(suffix)
-            for symbol, next_state in suffix.transitions.items():
-                if (symbol not in state.transitions and
-                        suffix != self._zero_state):
-                    state.transitions[symbol] = next_state
+                child.longest_strict_suffix = traversed.transitions.get(
+                    symbol, zero_state)
+                child.parent = None
+                to_process.append(child)
 
     def __str__(self):
         return "ahocorapy KeywordTree"
 
     def __getstate__(self):
-        state_list = [None] * self._counter
-        todo_list = [self._zero_state]
+        '''
+        Serializes the tree as flat arrays indexed by state identifier:
+        the parent and longest strict suffix of every state, the symbols of
+        all non-zero states (joined into one string if they are single
+        characters) and the matched keywords.
+        The goto table is rebuilt when unpickling, which is faster than
+        loading it and keeps pickles small.
+        '''
+        typecode = _index_typecode(self._counter)
+        parents = array(typecode, [0]) * self._counter
+        suffixes = array(typecode, [0]) * self._counter
+        symbols = [None] * self._counter
+        keywords = [None] * self._counter
+        seen = bytearray(self._counter)
+        seen[0] = 1
+        todo_list = deque([self._zero_state])
         while todo_list:
-            state = todo_list.pop()
-            transitions = {key: value.identifier for key,
-                           value in state.transitions.items()}
-            state_list[state.identifier] = {
-                'symbol': state.symbol,
-                'success': state.success,
-                'parent':  state.parent.identifier if state.parent is not None else None,
-                'matched_keyword': state.matched_keyword,
-                'longest_strict_suffix': state.longest_strict_suffix.identifier if state.longest_strict_suffix is not None else None,
-                'transitions': transitions
-            }
-            for child in state.transitions.values():
-                if len(state_list) <= child.identifier or not state_list[child.identifier]:
+            state = todo_list.popleft()
+            if state.success:
+                keywords[state.identifier] = state.matched_keyword
+            if state.longest_strict_suffix is not None:
+                suffixes[state.identifier] =\
+                    state.longest_strict_suffix.identifier
+            for symbol, child in state.transitions.items():
+                # Breadth first, shortcut transitions of trees pickled by
+                # older versions only lead to states that were already seen.
+                if not seen[child.identifier]:
+                    seen[child.identifier] = 1
+                    parents[child.identifier] = state.identifier
+                    symbols[child.identifier] = symbol
                     todo_list.append(child)
 
+        symbols = symbols[1:]
+        # Keywords given as bytes on python 3 have int symbols and keywords
+        # given as token sequences may have longer str symbols, which are
+        # kept as a list.
+        if all(isinstance(symbol, str) and len(symbol) == 1
+               for symbol in symbols):
+            symbols = u''.join(symbols)
+
         return {
             'case_insensitive': self._case_insensitive,
             'finalized': self._finalized,
             'counter': self._counter,
-            'states': state_list
+            'parents': parents,
+            'suffixes': suffixes if self._finalized else None,
+            'symbols': symbols,
+            'keywords': keywords
         }
 
     def __setstate__(self, state):
         self._case_insensitive = state['case_insensitive']
         self._counter = state['counter']
         self._finalized = state['finalized']
-        states = [None] * len(state['states'])
-        for idx, serialized_state in enumerate(state['states']):
+        if 'states' in state:
+            states = self._deserialize_state_list(state['states'])
+        else:
+            states = [State(0)]
+            states.extend(State(idx, symbol)
+                          for idx, symbol in enumerate(state['symbols'], 1))
+            parents = state['parents']
+            for idx in range(1, self._counter):
+                deserialized_state = states[idx]
+                parent = states[parents[idx]]
+                parent.transitions[deserialized_state.symbol] =\
+                    deserialized_state
+                if not self._finalized:
+                    deserialized_state.parent = parent
+            for idx, keyword in enumerate(state['keywords']):
+                if keyword is not None:
+                    states[idx].success = True
+                    states[idx].matched_keyword = keyword
+            if self._finalized:
+                for idx, suffix in enumerate(state['suffixes']):
+                    states[idx].longest_strict_suffix = states[suffix]
+        self._zero_state = states[0]
+        self._single_keyword = None
+        self._alphabet = self._ascii_columns = self._width = None
+        self._goto = self._output = None
+        if self._finalized:
+            self._build_tables()
+
+    def _deserialize_state_list(self, state_list):
+        '''
+        Restores the states from the per-state dicts pickled by older
+        versions.
+        '''
+        states = [None] * len(state_list)
+        for idx, serialized_state in enumerate(state_list):
             deserialized_state = State(idx, serialized_state['symbol'])
             deserialized_state.success = serialized_state['success']
             deserialized_state.matched_keyword = serialized_state['matched_keyword']
             states[idx] = deserialized_state
-        for idx, serialized_state in enumerate(state['states']):
+        for idx, serialized_state in enumerate(state_list):
             deserialized_state = states[idx]
             if serialized_state['longest_strict_suffix'] is not None:
                 deserialized_state.longest_strict_suffix = states[
@@ -238,7 +515,7 @@ class KeywordTree(object):
                 deserialized_state.parent = None
             deserialized_state.transitions = {
                 key: states[value] for key, value in serialized_state['transitions'].items()}
-        self._zero_state = states[0]
+        return states
 
 
 if __name__ == "__main__":
@@ -7,7 +7,12 @@
 @Desc: 手动实现AC自动机
 """
 
-from copy import deepcopy
+from array import array
+from collections import deque
+
+# goto表每个节点都占一整行，字符种类（列数）超过这个上限时（比如中文词典）不再构建goto表，
+# 搜索时沿着failure路径回退，避免内存随着 节点数 × 字符种类 膨胀
+_MAX_TABLE_WIDTH = 256
 
 
 class State(object):
@@ -44,6 +49,10 @@ class KdTree(object):
         self.case_sensitive = case_sensitive
         self._counter = 1
         self._finalized = False
+        self._alphabet = None  # 字符 -> goto表的列号，0号列留给不在任何关键词中的字符
+        self._width = None  # goto表的列数
+        self._goto = None  # goto[state_id * width + 列号] = 下一个状态序号，已经包含failure跳转
+        self._output = None  # output[state_id] = 在该状态结束的所有关键词
 
     def add_keyword(self, keyword):
         """添加关键词
@@ -52,7 +61,7 @@ class KdTree(object):
         """
         if self._finalized:
             raise ValueError("字典树已经构建完成，不能再添加新词")
-        origin_keyword = deepcopy(keyword)
+        origin_keyword = keyword
         if not self.case_sensitive:
             keyword = keyword.lower()
         current_node = self._zero_node
@@ -71,20 +80,25 @@ class KdTree(object):
         if self._finalized:
             raise ValueError("字典树已经构建完成，不能再添加failure路径")
         self._zero_node.failure = self._zero_node # 因为不会对根节点的failure进行判断，所以事先指定
-        self.find_failure_for_children(self._zero_node)
+        nodes = self.find_failure_for_children(self._zero_node)
+        self.build_goto_table(nodes)
         self._finalized = True # 当所有的节点都操作完毕后，finalized设置为True，表示failure全部添加完，字典树构建完毕
 
     def find_failure_for_children(self, zero_node):
-        to_add_failure_nodes = [zero_node]  # 要进行failure添加的节点
-        processed_node_id = set()  # 已经添加过的节点的state_id
+        """按广度优先的顺序为所有节点添加failure路径，
+        这样处理一个节点时，它父节点的failure一定已经找到了
+
+        :return: 按广度优先顺序排列的所有节点
+        """
+        nodes = []
+        to_add_failure_nodes = deque([zero_node])  # 要进行failure添加的节点
         while to_add_failure_nodes:
-            current_node = to_add_failure_nodes.pop()
-            if current_node.state_id not in processed_node_id:
-                processed_node_id.add(current_node.state_id)
-                children = current_node.transitions.values()
-                for child in children:
-                    self.find_failure(child)  # 为子节点找到failure指针指向的节点
-                    to_add_failure_nodes.append(child)
+            current_node = to_add_failure_nodes.popleft()
+            nodes.append(current_node)
+            for child in current_node.transitions.values():
+                self.find_failure(child)  # 为子节点找到failure指针指向的节点
+                to_add_failure_nodes.append(child)
+        return nodes
 
     def find_failure(self, node):
         """找到节点的failure路径
@@ -97,9 +111,6 @@ class KdTree(object):
             while True:
                 if node.symbol in traversed_node.transitions and node != traversed_node.transitions[node.symbol]:
                     node.failure = traversed_node.transitions[node.symbol]
-                    for symbol, node in node.failure.transitions.items():
-                        if symbol not in node.transitions:
-                            node.transitions[symbol] = node
                     break
                 elif traversed_node == self._zero_node:
                     node.failure = self._zero_node
@@ -107,22 +118,71 @@ class KdTree(object):
                 else:
                     traversed_node = traversed_node.failure
 
+    def build_goto_table(self, nodes):
+        """把字典树展开成goto表（DFA）：节点没有的转移直接取failure节点的转移，
+        搜索时每个字符只需要查一次表，不需要再沿着failure路径回退。
+        goto表是一整块连续的array，每个节点占width个格子。
+        字符种类超过_MAX_TABLE_WIDTH时只计算output，不构建goto表
+
+        :param nodes: 按广度优先顺序排列的所有节点，保证failure节点先处理
+        :return:
+        """
+        alphabet = {}
+        for node in nodes:
+            for character in node.transitions:
+                if character not in alphabet:
+                    alphabet[character] = len(alphabet) + 1
+        output = [None] * self._counter
+        for node in nodes:
+            if node is self._zero_node:
+                output[node.state_id] = []
+            else:
+                output[node.state_id] = output[node.failure.state_id]
+                if node.success:
+                    output[node.state_id] = [node.keyword] + output[node.state_id]
+        self._output = output
+        width = len(alphabet) + 1
+        if width > _MAX_TABLE_WIDTH or self._counter * width >= 1 << 31:
+            self._alphabet = self._width = self._goto = None
+            return
+        goto = array('i', [0]) * (self._counter * width)
+        for node in nodes:
+            offset = node.state_id * width
+            if node is not self._zero_node:
+                failure_offset = node.failure.state_id * width
+                goto[offset:offset + width] = goto[failure_offset:failure_offset + width]
+            for character, child in node.transitions.items():
+                goto[offset + alphabet[character]] = child.state_id
+        self._alphabet = alphabet
+        self._width = width
+        self._goto = goto
+
     def search_all(self, text):
         """搜索关键词"""
         if not self._finalized:
             raise ValueError("字典树尚未构建完成，需要先构建好字典树才能进行关键词搜索")
         if not self.case_sensitive:
             text = text.lower()
-        current_node = self._zero_node
-        for idx, symbol in enumerate(text):
-            if symbol in current_node.transitions:
-                if current_node.transitions[symbol].success:
-                    keyword = current_node.transitions[symbol].keyword
+        output = self._output
+        if self._goto is None:
+            # 没有goto表时按经典AC自动机的方式沿着failure路径回退
+            zero_node = self._zero_node
+            current_node = zero_node
+            for idx, symbol in enumerate(text):
+                while symbol not in current_node.transitions and current_node is not zero_node:
+                    current_node = current_node.failure
+                current_node = current_node.transitions.get(symbol, zero_node)
+                for keyword in output[current_node.state_id]:
                     yield (keyword, idx+1-len(keyword))
-                else:
-                    current_node = current_node.transitions[symbol]
-            else:
-                continue
+            return
+        alphabet = self._alphabet
+        width = self._width
+        goto = self._goto
+        current_state = 0
+        for idx, symbol in enumerate(text):
+            current_state = goto[current_state * width + alphabet.get(symbol, 0)]
+            for keyword in output[current_state]:  # 当前状态以及所有failure节点上匹配到的关键词
+                yield (keyword, idx+1-len(keyword))
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 from builtins import str
 from builtins import object
+from collections import deque
 import pygraphviz as pgv
 
 
@@ -9,9 +10,7 @@ class Visualizer(object):
         self._added = set()
 
 
-    def _add_state_and_children(self, kwtree, graph, state, added_state_ids):
-        if state.identifier in added_state_ids:
-            return
+    def _add_state(self, kwtree, graph, state):
         if state.success:
             current_state = state
             results = []
@@ -27,14 +26,21 @@ class Visualizer(object):
                     ','.join(results) + ']')
         else:
             graph.add_node(state.identifier)
-        added_state_ids.add(state.identifier)
-        for symbol, child in state.transitions.items():
-            self._add_state_and_children(kwtree, graph, child, added_state_ids)
-            graph.add_edge(state.identifier, child.identifier, label=symbol)
-    
-    
+
     def draw(self, filename, kwtree):
         graph = pgv.AGraph(directed=True)
-        added_state_ids = set()
-        self._add_state_and_children(kwtree, graph, kwtree._zero_state, added_state_ids)
+        edges = []
+        seen = bytearray(kwtree._counter)
+        seen[0] = 1
+        todo_list = deque([kwtree._zero_state])
+        while todo_list:
+            state = todo_list.popleft()
+            self._add_state(kwtree, graph, state)
+            for symbol, child in state.transitions.items():
+                edges.append((state.identifier, child.identifier, symbol))
+                if not seen[child.identifier]:
+                    seen[child.identifier] = 1
+                    todo_list.append(child)
+        for source, target, symbol in edges:
+            graph.add_edge(source, target, label=symbol)
         graph.draw(filename, prog='dot')
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from builtins import str
+from builtins import chr, str
 from io import open
 from pickle import dumps, loads
 import unittest
@@ -9,6 +9,10 @@ import unittest
 from ahocorapy.keywordtree import KeywordTree
 
 
+# More distinct symbols than fit into the columns of the flat table.
+WIDE_KEYWORD = u''.join(chr(0x4e00 + i) for i in range(300))
+
+
 class TestAhocorapy(unittest.TestCase):
 
     def test_empty_tree(self):
@@ -63,6 +67,41 @@ class TestAhocorapy(unittest.TestCase):
         with self.assertRaises(StopIteration):
             next(results)
 
+    def test_search_all_list(self):
+        kwtree = KeywordTree(case_insensitive=True)
+        kwtree.add('mallorca')
+        kwtree.add('mallorca bella')
+        kwtree.add('orca')
+        kwtree.add('lacrosse')
+        kwtree.finalize()
+
+        results = kwtree.search_all_list('malheur on mallorca bellacrosse')
+        self.assertEqual([('mallorca', 11), ('orca', 15),
+                          ('mallorca bella', 11), ('lacrosse', 23)], results)
+
+        results = kwtree.search_all_list('malheur')
+        self.assertEqual([], results)
+
+        kwtree = KeywordTree()
+        kwtree.add('bla')
+        self.assertRaises(ValueError, kwtree.search_all_list, 'bla')
+
+    def test_single_keyword(self):
+        kwtree = KeywordTree()
+        kwtree.add('aa')
+        kwtree.add('aa')
+        kwtree.finalize()
+
+        results = list(kwtree.search_all('aaaa'))
+        self.assertEqual([('aa', 0), ('aa', 1), ('aa', 2)], results)
+
+        kwtree = KeywordTree(case_insensitive=True)
+        kwtree.add('Bla')
+        kwtree.finalize()
+
+        results = kwtree.search_all_list('xBLAbla')
+        self.assertEqual([('Bla', 1), ('Bla', 4)], results)
+
     def test_suffix_stuff(self):
         kwtree = KeywordTree()
         kwtree.add('blaaaaaf')
@@ -149,6 +188,67 @@ class TestAhocorapy(unittest.TestCase):
         result = kwtree.search(u'三年过')
         self.assertIsNone(result)
 
+    def test_ascii_keywords_unicode_text(self):
+        kwtree = KeywordTree()
+        kwtree.add('bla')
+        kwtree.add('?')
+        kwtree.finalize()
+
+        result = kwtree.search(u'春华bla')
+        self.assertEqual(('bla', 2), result)
+
+        result = kwtree.search(u'春华变苍颜到处群魔乱')
+        self.assertIsNone(result)
+
+        results = list(kwtree.search_all('xblax?'))
+        self.assertEqual([('bla', 1), ('?', 5)], results)
+
+        results = kwtree.search_all_list(['x', 'b', 'l', 'a'])
+        self.assertEqual([('bla', 1)], results)
+
+    def test_bytes_keywords(self):
+        kwtree = KeywordTree()
+        kwtree.add(b'abc')
+        kwtree.add(b'bc')
+        kwtree.finalize()
+
+        results = kwtree.search_all_list(b'xabc')
+        self.assertEqual([(b'abc', 1), (b'bc', 2)], results)
+
+        deserialized = loads(dumps(kwtree))
+        results = deserialized.search_all_list(b'xabc')
+        self.assertEqual([(b'abc', 1), (b'bc', 2)], results)
+
+    def test_token_sequence_keywords(self):
+        kwtree = KeywordTree()
+        kwtree.add(('ab', 'cd'))
+        kwtree.add(('cd', 'e'))
+        kwtree.finalize()
+        self.assertIsNone(kwtree._ascii_columns)
+
+        results = kwtree.search_all_list(['x', 'ab', 'cd', 'e'])
+        self.assertEqual([(('ab', 'cd'), 1), (('cd', 'e'), 2)], results)
+
+        deserialized = loads(dumps(kwtree))
+        results = deserialized.search_all_list(['x', 'ab', 'cd', 'e'])
+        self.assertEqual([(('ab', 'cd'), 1), (('cd', 'e'), 2)], results)
+
+        kwtree = KeywordTree()
+        kwtree.add(('ab', 'cd'))
+        deserialized = loads(dumps(kwtree))
+        self.assertEqual(['ab'], list(deserialized._zero_state.transitions))
+        deserialized.finalize()
+
+        results = deserialized.search_all_list(['x', 'ab', 'cd', 'e'])
+        self.assertEqual([(('ab', 'cd'), 1)], results)
+
+        kwtree = KeywordTree()
+        kwtree.add(('ab', 'cd'))
+        kwtree.finalize()
+
+        results = kwtree.search_all_list(['x', 'ab', 'cd', 'e'])
+        self.assertEqual([(('ab', 'cd'), 1)], results)
+
     def test_case_sensitivity(self):
         kwtree = KeywordTree()
         kwtree.add('bla')
@@ -181,6 +281,12 @@ class TestAhocorapy(unittest.TestCase):
         result = kwtree.search('BLISS')
         self.assertEqual(('blISs', 0), result)
 
+        result = kwtree.search(u'ÄBLUE')
+        self.assertEqual(('blue', 1), result)
+
+        result = kwtree.search('[BL@]')
+        self.assertIsNone(result)
+
     def test_utility_calls(self):
         kwtree = KeywordTree(case_insensitive=True)
         kwtree.add('bla')
@@ -232,6 +338,16 @@ class TestAhocorapy(unittest.TestCase):
         with self.assertRaises(StopIteration):
             next(results)
 
+    def test_deep_tree(self):
+        kwtree = KeywordTree()
+        kwtree.add('a' * 5000)
+        kwtree.add('a' * 4999 + 'b')
+        kwtree.finalize()
+
+        results = list(kwtree.search_all('c' + 'a' * 5001 + 'b'))
+        self.assertEqual([('a' * 5000, 1), ('a' * 5000, 2),
+                          ('a' * 4999 + 'b', 3)], results)
+
     def test_search_all_issue_1(self):
         text = '/foo/bar'
         words = ['/bar', '/foo/bar', 'bar']
@@ -294,6 +410,72 @@ class TestAhocorapy(unittest.TestCase):
         self.assertEqual(('frodo', 20), next(results))
         self.assertEqual(('gandalf', 31), next(results))
 
+    def _legacy_state(self, finalized):
+        '''
+        Pickled state of a tree with the keywords 'ab', 'b' and 'bc' in
+        the per-state format of older versions. Once finalized, state 2
+        ('ab') holds the shortcut transition 'c' -> 4 ('bc').
+        '''
+        def serialized_state(symbol, parent, keyword, suffix, transitions):
+            return {
+                'symbol': symbol,
+                'success': keyword is not None,
+                'parent': parent,
+                'matched_keyword': keyword,
+                'longest_strict_suffix': suffix if finalized else None,
+                'transitions': transitions
+            }
+        return {
+            'case_insensitive': False,
+            'finalized': finalized,
+            'counter': 5,
+            'states': [
+                serialized_state(None, None, None, 0, {'a': 1, 'b': 3}),
+                serialized_state('a', 0, None, 0, {'b': 2}),
+                serialized_state('b', 1, 'ab', 3,
+                                 {'c': 4} if finalized else {}),
+                serialized_state('b', 0, 'b', 0, {'c': 4}),
+                serialized_state('c', 3, 'bc', 0, {})
+            ]
+        }
+
+    def test_unpickling_legacy_format(self):
+        expected = [('ab', 1), ('b', 2), ('bc', 2), ('b', 4), ('bc', 4)]
+
+        tree = KeywordTree.__new__(KeywordTree)
+        tree.__setstate__(self._legacy_state(finalized=True))
+
+        self.assertEqual(expected, tree.search_all_list('xabcbc'))
+        self.assertEqual(expected, list(tree.search_all('xabcbc')))
+
+        deserialized = loads(dumps(tree))
+
+        self.assertEqual(expected, deserialized.search_all_list('xabcbc'))
+        self.assertEqual([('ab', 0), ('b', 1), ('bc', 1)],
+                         deserialized.search_all_list('abc'))
+
+        tree = KeywordTree.__new__(KeywordTree)
+        tree.__setstate__(self._legacy_state(finalized=False))
+        self.assertRaises(ValueError, tree.search_all_list, 'xabcbc')
+        tree.finalize()
+
+        self.assertEqual(expected, tree.search_all_list('xabcbc'))
+        self.assertEqual(expected,
+                         loads(dumps(tree)).search_all_list('xabcbc'))
+
+    def test_pickling_without_flat_table(self):
+        tree = KeywordTree()
+        for word in ['/bar', '/foo/bar', 'bar', 'foo/', WIDE_KEYWORD]:
+            tree.add(word)
+        tree.finalize()
+        deserialized = loads(dumps(tree))
+        self.assertIsNone(deserialized._goto)
+
+        results = deserialized.search_all_list('/foo/bar')
+
+        self.assertEqual([('foo/', 1), ('/foo/bar', 0), ('/bar', 4),
+                          ('bar', 5)], results)
+
     def test_pickling_before_finalizing(self):
         words = ['peter', 'horst', 'gandalf', 'frodo']
         tree = KeywordTree(case_insensitive=True)
@@ -316,6 +498,38 @@ class TestAhocorapy(unittest.TestCase):
         self.assertEqual(('frodo', 20), next(results))
         self.assertEqual(('gandalf', 31), next(results))
 
+    def test_search_without_flat_table(self):
+        tree = KeywordTree(case_insensitive=True)
+        for word in ['/bar', '/foo/bar', 'bar', 'foo/', WIDE_KEYWORD]:
+            tree.add(word)
+        tree.finalize()
+        self.assertIsNone(tree._goto)
+
+        results = list(tree.search_all('/FOO/bar'))
+
+        self.assertEqual([('foo/', 1), ('/foo/bar', 0), ('/bar', 4),
+                          ('bar', 5)], results)
+        self.assertEqual(results, tree.search_all_list('/FOO/bar'))
+
+    def test_wide_alphabet_without_flat_table(self):
+        kwtree = KeywordTree()
+        for i in range(0, 600, 3):
+            kwtree.add(u''.join(chr(0x4e00 + i + j) for j in range(3)))
+        kwtree.add(u'颜到')
+        kwtree.finalize()
+        self.assertIsNone(kwtree._goto)
+
+        results = kwtree.search_all_list(u'春华变苍颜到' + chr(0x4e03) +
+                                         chr(0x4e04) + chr(0x4e05))
+        self.assertEqual([(u'颜到', 4), (chr(0x4e03) + chr(0x4e04) +
+                                         chr(0x4e05), 6)], results)
+
+        kwtree = KeywordTree()
+        kwtree.add(u'颜到')
+        kwtree.add(u'春华')
+        kwtree.finalize()
+        self.assertIsNotNone(kwtree._goto)
+
     def test_state_to_string(self):
         words = ['peter', 'horst', 'gandalf', 'frodo']
         tree = KeywordTree(case_insensitive=True)
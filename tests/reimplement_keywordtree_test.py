@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from builtins import chr
+import unittest
+
+from ahocorapy.reimplement_keywordtree import KdTree
+
+
+class TestKdTree(unittest.TestCase):
+
+    def test_overlapping_and_suffix_matches(self):
+        kdtree = KdTree(case_sensitive=False)
+        for word in ['mallorca', 'orca', 'mallorca bella', 'lacrosse']:
+            kdtree.add_keyword(word)
+        kdtree.finalize()
+
+        results = list(kdtree.search_all('malheur on mallorca bellacrosse'))
+
+        self.assertEqual([('mallorca', 11), ('orca', 15),
+                          ('mallorca bella', 11), ('lacrosse', 23)], results)
+
+    def test_failure_to_other_branch(self):
+        kdtree = KdTree()
+        for word in ['/bar', '/foo/bar', 'bar', 'foo/']:
+            kdtree.add_keyword(word)
+        kdtree.finalize()
+
+        results = list(kdtree.search_all('/foo/bar'))
+
+        self.assertEqual([('foo/', 1), ('/foo/bar', 0), ('/bar', 4),
+                          ('bar', 5)], results)
+
+    def test_wide_alphabet_without_goto_table(self):
+        kdtree = KdTree()
+        for i in range(0, 600, 3):
+            kdtree.add_keyword(u''.join(chr(0x4e00 + i + j) for j in range(3)))
+        kdtree.add_keyword(u'颜到')
+        kdtree.add_keyword(u'到处')
+        kdtree.finalize()
+        self.assertIsNone(kdtree._goto)
+
+        text = u'春华变苍颜到处' + chr(0x4e03) + chr(0x4e04) + chr(0x4e05)
+        results = list(kdtree.search_all(text))
+
+        self.assertEqual([(u'颜到', 4), (u'到处', 5),
+                          (chr(0x4e03) + chr(0x4e04) + chr(0x4e05), 7)],
+                         results)
+
+        kdtree = KdTree()
+        kdtree.add_keyword(u'颜到')
+        kdtree.finalize()
+        self.assertIsNotNone(kdtree._goto)
+
+    def test_case_sensitivity(self):
+        kdtree = KdTree()
+        kdtree.add_keyword('blISs')
+        kdtree.finalize()
+
+        self.assertEqual([], list(kdtree.search_all('BLISS')))
+        self.assertEqual([('blISs', 0)], list(kdtree.search_all('blISs')))
+
+    def test_finalize_errors(self):
+        kdtree = KdTree()
+        kdtree.add_keyword('bla')
+
+        self.assertRaises(ValueError, list, kdtree.search_all('bla'))
+
+        kdtree.finalize()
+
+        self.assertRaises(ValueError, kdtree.add_keyword, 'blue')
+        self.assertRaises(ValueError, kdtree.finalize)
+
+
+if __name__ == '__main__':
+    unittest.main()